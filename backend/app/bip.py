@@ -1,39 +1,110 @@
 from __future__ import annotations
 
 import io
+import logging
+import pickle
+from functools import cached_property
 from pathlib import Path
-from typing import List, Optional
-
-import docx
-import fitz  # PyMuPDF
-from docx.oxml.ns import qn
+from typing import List, Optional, Tuple
 
 from .providers import ModelProvider
-from .rag import RAGStore
+from .rag import RAGStore, iter_node_text
 from .settings import Settings
 
+_logger = logging.getLogger(__name__)
+
+_PROMPT_PREAMBLE = (
+    "You are a certified behavior analyst creating a Behavior Intervention Plan (BIP) "
+    "for The Center for Discovery. Use people-first, observable, measurable language. "
+    "Ensure replacement behaviors are functionally equivalent to the target behavior."
+    "\n\nFollow these guidelines when writing the plan:"
+    "\n- Adhere to New York State OPWDD and The Center for Discovery standards."
+    "\n- Avoid mentalistic explanations (e.g., 'the student wants attention')."
+    "\n- Provide goals that are measurable with clear criteria."
+    "\n- Include safety precautions when relevant."
+)
+
+_PROMPT_INSTRUCTIONS = (
+    "\nPlease produce a complete BIP that includes:\n"
+    "- FBA Summary\n"
+    "- Operational Definition\n"
+    "- Replacement Behaviors\n"
+    "- Prevention Strategies\n"
+    "- Reinforcement Plan\n"
+    "- Data Collection Method\n"
+    "- Crisis/Safety Plan if applicable\n"
+    "- Three short-term goals and one long-term goal with measurable criteria\n"
+)
+
+# Clark-notation tags (what python-docx's qn() returns) for the WordprocessingML
+# elements read below; spelled out so python-docx is only imported for .docx uploads.
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P = f"{_W_NS}p"
+_W_R = f"{_W_NS}r"
+_W_T = f"{_W_NS}t"
+_W_TAB = f"{_W_NS}tab"
+_W_BR = f"{_W_NS}br"
+_W_CR = f"{_W_NS}cr"
+
 
 class BIPService:
     def __init__(self, settings: Settings, provider: ModelProvider, rag_store: RAGStore):
         self.settings = settings
         self.provider = provider
         self.rag_store = rag_store
-        self._few_shot_examples = self._load_examples()
 
     def _examples_dir(self) -> Path:
         return Path(self.settings.bip_examples_dir)
 
+    def _examples_cache_path(self) -> Path:
+        return Path(self.settings.vector_store_dir) / "bip_examples.pkl"
+
+    @cached_property
+    def _few_shot_examples(self) -> List[str]:
+        return self._load_examples()
+
     def _load_examples(self) -> List[str]:
         directory = self._examples_dir()
         if not directory.exists():
             return []
+        paths = sorted(directory.glob("*.txt"))
+        signature: List[Tuple[str, int, int]] = []
+        for path in paths:
+            stat = path.stat()
+            signature.append((path.name, stat.st_mtime_ns, stat.st_size))
+
+        # One read of a pickled snapshot instead of one read per example file;
+        # the snapshot is reused only while every file's name, mtime and size match.
+        cache_path = self._examples_cache_path()
+        try:
+            cached_signature, cached_examples = pickle.loads(cache_path.read_bytes())
+            if cached_signature == signature:
+                return cached_examples
+        except Exception:
+            pass
+
         examples: List[str] = []
-        for path in sorted(directory.glob("*.txt")):
+        for path in paths:
             content = path.read_text().strip()
             if content:
                 examples.append(content)
+
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_path.write_bytes(pickle.dumps((signature, examples), pickle.HIGHEST_PROTOCOL))
+        except OSError as exc:
+            _logger.warning("Could not write BIP examples cache %s: %s", cache_path, exc)
         return examples
 
+    @cached_property
+    def _prompt_prefix(self) -> str:
+        # Static across requests, so assembled once. Kept as a plain string rather
+        # than a str.format template because the examples may contain braces.
+        if not self._few_shot_examples:
+            return _PROMPT_PREAMBLE
+        examples_block = "\n---\n".join(self._few_shot_examples[:3])
+        return f"{_PROMPT_PREAMBLE}\n\n[REFERENCE EXAMPLES]\n{examples_block}"
+
     def build_prompt(
         self,
         name: str,
@@ -45,8 +116,6 @@ class BIPService:
         notes: Optional[str],
         fba_text: Optional[str],
     ) -> str:
-        examples_block = "\n---\n".join(self._few_shot_examples[:3]) if self._few_shot_examples else ""
-
         user_profile = (
             "Student Profile:\n"
             f"- Name: {name}\n"
@@ -68,103 +137,92 @@ class BIPService:
         except Exception:
             policy_nodes = []
 
-        policy_context = "\n\n".join(
-            node.node.get_content().strip()
-            for node in policy_nodes
-            if node.node and node.node.get_content().strip()
-        )
-
-        prompt = (
-            "You are a certified behavior analyst creating a Behavior Intervention Plan (BIP) "
-            "for The Center for Discovery. Use people-first, observable, measurable language. "
-            "Ensure replacement behaviors are functionally equivalent to the target behavior."
-        )
-
-        prompt += (
-            "\n\nFollow these guidelines when writing the plan:"
-            "\n- Adhere to New York State OPWDD and The Center for Discovery standards."
-            "\n- Avoid mentalistic explanations (e.g., 'the student wants attention')."
-            "\n- Provide goals that are measurable with clear criteria."
-            "\n- Include safety precautions when relevant."
+        policy_context = "\n\n".join(content for _, content in iter_node_text(policy_nodes, collapse_whitespace=True))
+
+        policy_block = f"\n\n[POLICY CONTEXT]\n{policy_context}" if policy_context else ""
+        return "".join(
+            (
+                self._prompt_prefix,
+                policy_block,
+                "\n\n[NEW REQUEST]\n",
+                user_profile,
+                "\n",
+                _PROMPT_INSTRUCTIONS,
+            )
         )
 
-        if examples_block:
-            prompt += f"\n\n[REFERENCE EXAMPLES]\n{examples_block}"
-
-        if policy_context:
-            prompt += f"\n\n[POLICY CONTEXT]\n{policy_context}"
-
-        prompt += (
-            "\n\n[NEW REQUEST]\n"
-            f"{user_profile}\n"
-            "\nPlease produce a complete BIP that includes:\n"
-            "- FBA Summary\n"
-            "- Operational Definition\n"
-            "- Replacement Behaviors\n"
-            "- Prevention Strategies\n"
-            "- Reinforcement Plan\n"
-            "- Data Collection Method\n"
-            "- Crisis/Safety Plan if applicable\n"
-            "- Three short-term goals and one long-term goal with measurable criteria\n"
-        )
-        return prompt
-
-    def generate(self, prompt: str, model_override: Optional[str] = None) -> str:
-        return self.provider.chat(
+    async def agenerate(self, prompt: str, model_override: Optional[str] = None) -> str:
+        return await self.provider.achat(
             messages=[{"role": "user", "content": prompt}],
             model=model_override,
         )
 
     @staticmethod
-    def extract_text_from_upload(filename: str, content: bytes) -> Optional[str]:
+    def extract_text_from_upload(
+        filename: str, content: bytes, max_chars: Optional[int] = None
+    ) -> Optional[str]:
+        """Extract plain text from an upload, stopping early once ``max_chars`` are collected."""
         suffix = Path(filename).suffix.lower()
         if suffix == ".pdf":
-            return BIPService._extract_pdf(content)
-        if suffix == ".docx":
-            return BIPService._extract_docx(content)
-        if suffix == ".txt":
-            return content.decode("utf-8", errors="ignore")
-        return None
+            text = BIPService._extract_pdf(content, max_chars)
+        elif suffix == ".docx":
+            text = BIPService._extract_docx(content, max_chars)
+        elif suffix == ".txt":
+            # UTF-8 needs at most four bytes per character.
+            raw = content if max_chars is None else content[: max_chars * 4]
+            text = raw.decode("utf-8", errors="ignore")
+        else:
+            return None
+        return text if max_chars is None else text[:max_chars]
 
     @staticmethod
-    def _extract_pdf(content: bytes) -> str:
+    def _extract_pdf(content: bytes, max_chars: Optional[int] = None) -> str:
+        import fitz  # PyMuPDF
+
+        # Plain text extraction without ligature preservation or image handling.
+        flags = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP
+        buffer = io.StringIO()
+        written = 0
         with fitz.open(stream=content, filetype="pdf") as doc:
-            pages = [page.get_text() for page in doc]
-        return "\n".join(pages)
+            for index, page in enumerate(doc):
+                if max_chars is not None and written >= max_chars:
+                    break
+                if index:
+                    written += buffer.write("\n")
+                written += buffer.write(page.get_text("text", flags=flags))
+        return buffer.getvalue()
 
     @staticmethod
-    def _extract_docx(content: bytes) -> str:
-        file_like = io.BytesIO(content)
-        document = docx.Document(file_like)
+    def _extract_docx(content: bytes, max_chars: Optional[int] = None) -> str:
+        import docx
+
+        # A fresh BytesIO over immutable bytes shares the caller's buffer (no copy);
+        # a reused, truncated buffer would copy every upload and pin the largest one.
+        document = docx.Document(io.BytesIO(content))
         lines: List[str] = []
+        bits: List[str] = []
+        collected = 0
 
-        def extract_paragraph(paragraph: docx.text.paragraph.Paragraph) -> str:
-            if paragraph.runs:
-                bits = []
-                for run in paragraph.runs:
-                    text = run.text
-                    if text:
-                        bits.append(text)
-                combined = "".join(bits)
-                if combined:
-                    return combined
-            return paragraph.text
-
-        for paragraph in document.paragraphs:
-            text = extract_paragraph(paragraph).strip()
+        def flush() -> None:
+            nonlocal collected
+            text = "".join(bits).strip()
             if text:
                 lines.append(text)
-
-        for table in document.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    cell_lines = []
-                    for paragraph in cell.paragraphs:
-                        text = extract_paragraph(paragraph).strip()
-                        if text:
-                            cell_lines.append(text)
-                    text = " ".join(cell_lines)
-                    if text:
-                        lines.append(text)
+                collected += len(text) + 1
+            bits.clear()
+
+        # One walk over the body XML in document order, so table text stays
+        # next to the paragraphs around it.
+        for element in document.element.body.iter(_W_P, _W_T, _W_TAB, _W_BR, _W_CR):
+            if element.tag == _W_P:
+                flush()
+                if max_chars is not None and collected >= max_chars:
+                    break
+            elif element.tag == _W_T:
+                if element.text:
+                    bits.append(element.text)
+            elif element.getparent().tag == _W_R:
+                bits.append("\t" if element.tag == _W_TAB else "\n")
+        flush()
 
         return "\n".join(lines)
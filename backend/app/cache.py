@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class TTLCache:
+    """Bounded LRU whose entries expire ``ttl`` seconds after insertion."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 900.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] >= self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+class SemanticCache:
+    """Bounded store of (embedding, payload) pairs matched by cosine similarity.
+
+    With a ``ttl``, entries stop matching that many seconds after insertion.
+    """
+
+    def __init__(self, max_entries: int = 256, threshold: float = 0.95, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._stamps: Dict[str, np.ndarray] = {}
+        self._payloads: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalise(vector: Sequence[float]) -> Optional[np.ndarray]:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(array))
+        if not norm:
+            return None
+        return array / norm
+
+    def get(self, namespace: str, vector: Sequence[float]) -> Optional[Any]:
+        query = self._normalise(vector)
+        if query is None:
+            return None
+        with self._lock:
+            matrix = self._vectors.get(namespace)
+            if matrix is None or matrix.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            scores = matrix @ query
+            if self.ttl is not None:
+                expired = time.monotonic() - self._stamps[namespace] >= self.ttl
+                scores[expired] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._payloads[namespace][best]
+
+    def put(self, namespace: str, vector: Sequence[float], payload: Any) -> None:
+        row = self._normalise(vector)
+        if row is None or self.max_entries <= 0:
+            return
+        with self._lock:
+            matrix = self._vectors.get(namespace)
+            payloads = self._payloads.setdefault(namespace, [])
+            if matrix is None or matrix.shape[1] != row.shape[0]:
+                matrix = np.empty((0, row.shape[0]), dtype=np.float32)
+                self._stamps[namespace] = np.empty(0)
+                payloads.clear()
+            matrix = np.vstack((matrix, row))
+            stamps = np.append(self._stamps[namespace], time.monotonic())
+            payloads.append(payload)
+            if len(payloads) > self.max_entries:
+                overflow = len(payloads) - self.max_entries
+                matrix = matrix[overflow:]
+                stamps = stamps[overflow:]
+                del payloads[:overflow]
+            self._vectors[namespace] = matrix
+            self._stamps[namespace] = stamps
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors.clear()
+            self._stamps.clear()
+            self._payloads.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            size = sum(len(payloads) for payloads in self._payloads.values())
+            return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+class ResponseCache:
+    """Two-tier cache for model responses: exact payload hash, then query similarity."""
+
+    def __init__(
+        self, max_entries: int = 256, similarity_threshold: float = 0.95, ttl: float = 3600.0
+    ):
+        self._exact = TTLCache(max_entries, ttl)
+        self.semantic = SemanticCache(max_entries, similarity_threshold, ttl)
+
+    @staticmethod
+    def make_key(payload: List[Dict[str, str]], model: Optional[str], version: int) -> str:
+        serialised = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        digest = hashlib.sha256()
+        digest.update(serialised.encode("utf-8"))
+        digest.update(f"\0{model or ''}\0{version}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        return self._exact.get(key)
+
+    def put(self, key: str, response: str) -> None:
+        # A blank reply is a model hiccup, not an answer worth replaying.
+        if response and response.strip():
+            self._exact.put(key, response)
+
+    def clear(self) -> None:
+        self._exact.clear()
+        self.semantic.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {"exact": self._exact.stats(), "semantic": self.semantic.stats()}
@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from llama_index.embeddings.ollama import OllamaEmbedding
+
+
+@lru_cache(maxsize=4)
+def get_embed_model(model_name: str, base_url: str, embed_batch_size: int) -> OllamaEmbedding:
+    """Process-wide embedding client, so every caller shares one Ollama connection pool."""
+    from llama_index.embeddings.ollama import OllamaEmbedding
+
+    return OllamaEmbedding(
+        model_name=model_name,
+        base_url=base_url.rstrip("/"),
+        embed_batch_size=embed_batch_size,
+    )
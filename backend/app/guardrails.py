@@ -1,54 +1,219 @@
 from __future__ import annotations
 
-from textstat import flesch_kincaid_grade
+import asyncio
+import hashlib
+import logging
+import re
+from typing import AsyncIterable, AsyncIterator, Dict, Tuple
 
-from .providers import ModelProvider
+import anyio
+
+from .cache import TTLCache
+from .providers import ModelProvider, ModelProviderError
 from .settings import Settings
 
+try:
+    import ahocorasick
+except ImportError:  # pragma: no cover - optional dependency
+    ahocorasick = None  # type: ignore
+
+_logger = logging.getLogger(__name__)
+
 BANNED_TERMS = {
     "retarded",
     "handicapped",
     "crazy",
 }
 
+_BANNED_RE = re.compile(
+    "|".join(re.escape(term) for term in sorted(BANNED_TERMS)),
+    re.IGNORECASE,
+)
+
+
+def _build_banned_automaton():
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for term in BANNED_TERMS:
+        automaton.add_word(term, term)
+    automaton.make_automaton()
+    return automaton
+
+
+# Single-pass matcher whose cost does not grow with the number of terms; the regex
+# alternation above is the fallback when pyahocorasick is not installed.
+_BANNED_AUTOMATON = _build_banned_automaton()
+
+# Characters carried between streamed fragments so a term split across them still matches.
+_BANNED_OVERLAP = max(len(term) for term in BANNED_TERMS) - 1
+
+_LANGUAGE_NOTICE = "I’m sorry—that wording can be harmful. Here is a respectful phrasing:"
+
+# Texts under both limits score at or below grade 8 (Flesch-Kincaid) without
+# needing a syllable count; anything else gets the full textstat computation.
+_PROXY_MAX_WORDS_PER_SENTENCE = 12
+_PROXY_MAX_CHARS_PER_WORD = 4.5
+# Flesch-Kincaid is noisy on a few sentences; short replies and single-sentence
+# or unpunctuated text (bullet lists, links) are never rewritten.
+_MIN_REWRITE_CHARS = 300
+_MIN_REWRITE_SENTENCES = 2
+
+# Rewrites in flight, keyed like the rewrite cache so identical answers share one model call.
+# Those that outlive their request's timeout finish in the background and land in the
+# cache; past settings.rewrite_max_in_flight, new rewrites are skipped rather than queued.
+_rewrites_in_flight: Dict[tuple, asyncio.Task] = {}
+
+
+def _obviously_readable(text: str, sentences: int) -> bool:
+    words = text.count(" ") + text.count("\n") + 1
+    return (
+        words / sentences < _PROXY_MAX_WORDS_PER_SENTENCE
+        and len(text) / words < _PROXY_MAX_CHARS_PER_WORD
+    )
+
+
+def _contains_banned_term(text: str) -> bool:
+    if _BANNED_AUTOMATON is not None:
+        return next(_BANNED_AUTOMATON.iter(text.casefold()), None) is not None
+    return _BANNED_RE.search(text) is not None
+
 
 def cleanse_language(text: str) -> str:
-    lowered = text.lower()
-    if any(term in lowered for term in BANNED_TERMS):
-        return (
-            "I’m sorry—that wording can be harmful. Here is a respectful phrasing:\n\n"
-            + text.replace("\n", " ")
-        )
+    if _contains_banned_term(text):
+        return f"{_LANGUAGE_NOTICE}\n\n" + text.replace("\n", " ")
     return text
 
 
-def ensure_readability(
-    text: str,
-    provider: ModelProvider,
-    settings: Settings,
-) -> str:
+def needs_rewrite(text: str) -> bool:
+    if len(text) < _MIN_REWRITE_CHARS:
+        return False
+    terminators = text.count(".") + text.count("!") + text.count("?")
+    if terminators < _MIN_REWRITE_SENTENCES or _obviously_readable(text, terminators + 1):
+        return False
+
+    from textstat import flesch_kincaid_grade  # deferred: slow to import, rarely reached
+
     try:
         grade = flesch_kincaid_grade(text)
     except Exception:
-        return text
+        return False
+
+    return grade > 8
 
-    if grade <= 8:
-        return text
 
-    prompt = (
+def _rewrite_prompt(text: str) -> str:
+    return (
         "Rewrite the following content so it reads at a U.S. grade 6-8 level, "
         "using respectful, people-first language and preserving key details. "
         "Answer directly without mentioning that you rewrote the text or adjusted the reading level. "
         "Format headings or key points with Markdown if helpful.\n\n"
         f"{text}"
     )
-    rewritten = provider.chat(
-        messages=[{"role": "user", "content": prompt}],
+
+
+def _rewrite_key(text: str, settings: Settings) -> tuple:
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    return settings.rewrite_model, digest
+
+
+async def arewrite_for_readability(
+    text: str, provider: ModelProvider, settings: Settings, cache: TTLCache
+) -> str:
+    # Canned RAG answers repeat verbatim, so a rewrite is reused instead of asking the model again.
+    key = _rewrite_key(text, settings)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    rewritten = await provider.achat(
+        messages=[{"role": "user", "content": _rewrite_prompt(text)}],
         model=settings.rewrite_model,
     )
+    if rewritten:
+        cache.put(key, rewritten)
     return rewritten or text
 
 
-def apply_guardrails(text: str, provider: ModelProvider, settings: Settings) -> str:
+async def apply_guardrails(
+    text: str,
+    provider: ModelProvider,
+    settings: Settings,
+    cache: TTLCache,
+) -> Tuple[str, bool]:
+    """Cleanse wording and, when needed, rewrite for readability within ``settings.rewrite_timeout``.
+
+    Returns the guarded text and whether it was rewritten. A rewrite that times out or
+    fails leaves the cleansed text in place.
+    """
+    if len(text) < _MIN_REWRITE_CHARS and not _contains_banned_term(text):
+        return text, False
     intermediate = cleanse_language(text)
-    return ensure_readability(intermediate, provider, settings)
+    if not await anyio.to_thread.run_sync(needs_rewrite, intermediate):
+        return intermediate, False
+
+    key = _rewrite_key(intermediate, settings)
+    task = _rewrites_in_flight.get(key)
+    if task is None:
+        if len(_rewrites_in_flight) >= settings.rewrite_max_in_flight:
+            _logger.info("Skipping readability rewrite: %d already in flight", len(_rewrites_in_flight))
+            return intermediate, False
+        task = asyncio.ensure_future(
+            arewrite_for_readability(intermediate, provider, settings, cache)
+        )
+        _rewrites_in_flight[key] = task
+        task.add_done_callback(lambda done: _finish_rewrite(key, done))
+    try:
+        rewritten = await asyncio.wait_for(
+            asyncio.shield(task), settings.rewrite_timeout or None
+        )
+    except asyncio.TimeoutError:
+        return intermediate, False
+    except ModelProviderError as exc:
+        _logger.warning("Readability rewrite failed: %s", exc)
+        return intermediate, False
+    return rewritten, rewritten != intermediate
+
+
+def _finish_rewrite(key: tuple, task: asyncio.Task) -> None:
+    if _rewrites_in_flight.get(key) is task:
+        del _rewrites_in_flight[key]
+    if not task.cancelled() and task.exception() is not None:
+        _logger.debug("Readability rewrite failed: %s", task.exception())
+
+
+async def stream_guardrails(
+    chunks: AsyncIterable[str],
+    provider: ModelProvider,
+    settings: Settings,
+    cache: TTLCache,
+) -> AsyncIterator[Tuple[str, str]]:
+    """Guard a streamed response, yielding ``(event, text)`` pairs as fragments arrive.
+
+    The readability rewrite only runs once the stream ends and the full text scores above grade 8.
+    """
+    parts = []
+    tail = ""
+    flagged = False
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        parts.append(chunk)
+        if not flagged:
+            window = tail + chunk
+            if _contains_banned_term(window):
+                flagged = True
+                yield "notice", _LANGUAGE_NOTICE
+            tail = window[-_BANNED_OVERLAP:]
+        yield "delta", chunk
+
+    text = "".join(parts)
+    if await anyio.to_thread.run_sync(needs_rewrite, text):
+        yield "rewrite_needed", ""
+        try:
+            rewritten = await arewrite_for_readability(text, provider, settings, cache)
+        except ModelProviderError as exc:
+            # The answer itself is complete; fall back to the cleansed original.
+            _logger.warning("Readability rewrite failed: %s", exc)
+            rewritten = cleanse_language(text)
+        yield "rewrite", rewritten
+    yield "done", ""
@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None  # type: ignore
+
+# Request bodies, Ollama payloads and SSE events are parsed and encoded with orjson
+# when it is installed. orjson.JSONDecodeError subclasses json.JSONDecodeError, so
+# callers catch the standard exception either way.
+json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def json_dumps(value: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False)
+
+
+def json_bytes(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
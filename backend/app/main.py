@@ -1,20 +1,28 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 import re
-from typing import List
+from contextlib import asynccontextmanager
+from typing import AsyncIterable, AsyncIterator, List, Optional
 
 from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import ValidationError
 from starlette.datastructures import UploadFile as StarletteUploadFile
 
 from .bip import BIPService
-from .guardrails import apply_guardrails
+from .cache import ResponseCache, TTLCache
+from .guardrails import apply_guardrails, stream_guardrails
+from .jsonutil import json_dumps, json_loads
 from .providers import ModelProvider, ModelProviderError
-from .rag import CorpusNotReady, RAGStore
+from .rag import CorpusNotReady, RAGStore, iter_node_text
 from .schemas import (
+    BIPBatchResult,
+    BIPRequest,
     BIPResponse,
     ChatRequest,
     ChatResponse,
@@ -25,7 +33,7 @@ from .settings import Settings, get_settings
 logging.basicConfig(level=logging.INFO)
 _logger = logging.getLogger(__name__)
 
-GENERIC_PROMPT_WORDS = {
+GENERIC_PROMPT_WORDS = frozenset({
     "summarize",
     "summarise",
     "summary",
@@ -43,14 +51,49 @@ GENERIC_PROMPT_WORDS = {
     "clarify",
     "give",
     "tell",
-}
+})
 
-app = FastAPI(title="ChaTCFD Complete", version="0.1.0")
+# Attachments are only quoted as 1200-character snippets, so extraction stops well before
+# a large upload is fully materialised.
+_ATTACHMENT_MAX_CHARS = 8192
+
+_TOKEN_RE = re.compile(r"[a-zA-Z0-9]+")
+_SUMMARY_RE = re.compile(r"summari[sz]e|summary")
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    warm_up = None
+    if settings.rag_warmup:
+        # Load persisted indexes in the background so the server accepts requests meanwhile.
+        warm_up = asyncio.create_task(run_in_threadpool(rag_store.warm_up))
+    yield
+    if warm_up is not None and not warm_up.done():
+        warm_up.cancel()
+    await provider.aclose()
+
+
+app = FastAPI(
+    title="ChaTCFD Complete",
+    version="0.1.0",
+    lifespan=lifespan,
+)
 
 settings: Settings = get_settings()
 provider = ModelProvider(settings)
 rag_store = RAGStore(settings)
 bip_service = BIPService(settings, provider, rag_store)
+response_cache = ResponseCache(
+    settings.response_cache_size, settings.semantic_cache_threshold, settings.response_cache_ttl
+)
+rewrite_cache = TTLCache(settings.rewrite_cache_size, settings.rewrite_cache_ttl)
+
+BENEFITS_SYSTEM_PROMPT = (
+    "You are the benefits assistant for The Center for Discovery. Answer confidently, "
+    "clearly, and concisely using only the provided context. If information is missing, "
+    "reply with: 'I couldn't find that in the documentation.'"
+    " When you reference an organisation or resource that has a public website, include the official URL using Markdown link format (e.g., [Autism Speaks](https://autismspeaks.org))."
+)
 
 cors_origins = settings.origins_list()
 allow_credentials = True
@@ -83,10 +126,100 @@ def healthcheck() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def metrics() -> dict:
+    return {
+        "rag_version": rag_store.version,
+        "responses": response_cache.stats(),
+        "rewrites": rewrite_cache.stats(),
+        **rag_store.cache_stats(),
+    }
+
+
 def _prepare_payload(messages) -> List[dict[str, str]]:
     return [{"role": m.role, "content": m.content} for m in messages]
 
 
+async def _embed_semantic_query(query: Optional[str]) -> Optional[List[float]]:
+    if not query:
+        return None
+    try:
+        return await run_in_threadpool(rag_store.embed_query, query)
+    except Exception as exc:
+        _logger.warning("Semantic cache lookup skipped: %s", exc)
+        return None
+
+
+async def _cached_chat(
+    payload: List[dict[str, str]],
+    model: Optional[str],
+    mode: str,
+    query_vector: Optional[List[float]] = None,
+) -> str:
+    key = ResponseCache.make_key(payload, model, rag_store.version)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    namespace = f"{mode}:{model or settings.default_model}:{rag_store.version}"
+    if query_vector is not None:
+        cached = response_cache.semantic.get(namespace, query_vector)
+        if cached is not None:
+            response_cache.put(key, cached)
+            return cached
+
+    response = await provider.achat(payload, model=model)
+    if response.strip():
+        response_cache.put(key, response)
+        if query_vector is not None:
+            response_cache.semantic.put(namespace, query_vector, response)
+    return response
+
+
+def _sse(event: str, text: str) -> str:
+    return f"event: {event}\ndata: {json_dumps({'text': text})}\n\n"
+
+
+async def _stream_chat(payload: List[dict[str, str]], model: Optional[str]) -> AsyncIterator[str]:
+    key = ResponseCache.make_key(payload, model, rag_store.version)
+    cached = response_cache.get(key)
+    parts: List[str] = []
+    finished = False
+
+    async def replay(text: str) -> AsyncIterator[str]:
+        yield text
+
+    async def collect(chunks: AsyncIterable[str]) -> AsyncIterator[str]:
+        nonlocal finished
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        finished = True
+
+    chunks = replay(cached) if cached is not None else collect(provider.achat_stream(payload, model=model))
+    try:
+        async for event, text in stream_guardrails(chunks, provider, settings, rewrite_cache):
+            yield _sse(event, text)
+    except ModelProviderError as exc:
+        yield _sse("error", str(exc))
+        return
+    # Only a reply the provider completed is cached; a truncated or empty one would be
+    # replayed to every identical request.
+    answer = "".join(parts)
+    if cached is None and finished and answer.strip():
+        response_cache.put(key, answer)
+
+
+def _has_meaningful_token(text: str) -> bool:
+    # Lowercases candidate tokens only, so a long pasted document is neither
+    # copied nor fully scanned: the loop stops at the first topical word.
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group()
+        if len(token) >= 4 and token.lower() not in GENERIC_PROMPT_WORDS:
+            return True
+    return False
+
+
 def _format_sources(nodes) -> List[SourceDocument]:
     formatted: List[SourceDocument] = []
     for idx, node in enumerate(nodes, start=1):
@@ -113,18 +246,22 @@ async def general_chat(
         if payload_raw is None:
             raise HTTPException(status_code=400, detail="Missing payload field")
         try:
-            data = json.loads(payload_raw)
+            data = json_loads(payload_raw)
         except json.JSONDecodeError as exc:
             raise HTTPException(status_code=400, detail=f"Invalid JSON payload: {exc}") from exc
 
         files = form.getlist("files")
-        _logger.info("Form keys: %s", list(form.keys()))
-        _logger.info("Received %d raw file objects", len(files))
+        debug = _logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            _logger.debug("Form keys: %s", list(form.keys()))
+            _logger.debug("Received %d raw file objects", len(files))
         for file_obj in files:
             if not isinstance(file_obj, (UploadFile, StarletteUploadFile)):
-                _logger.info("Skipping unexpected file object type: %s", type(file_obj))
+                if debug:
+                    _logger.debug("Skipping unexpected file object type: %s", type(file_obj))
                 continue
-            _logger.info("Processing attachment: %s (%s)", file_obj.filename, type(file_obj))
+            if debug:
+                _logger.debug("Processing attachment: %s (%s)", file_obj.filename, type(file_obj))
             try:
                 contents = await file_obj.read()
             except Exception:
@@ -132,8 +269,14 @@ async def general_chat(
             if not contents:
                 _logger.warning("Attachment %s was empty", file_obj.filename)
                 continue
-            text = BIPService.extract_text_from_upload(file_obj.filename, contents)
-            _logger.info("Attachment %s extracted length %s", file_obj.filename, len(text or ""))
+            text = await run_in_threadpool(
+                BIPService.extract_text_from_upload,
+                file_obj.filename,
+                contents,
+                _ATTACHMENT_MAX_CHARS,
+            )
+            if debug:
+                _logger.debug("Attachment %s extracted length %s", file_obj.filename, len(text or ""))
             if not text:
                 _logger.warning("Attachment %s could not be parsed", file_obj.filename)
                 continue
@@ -143,10 +286,12 @@ async def general_chat(
                     "content": text.strip(),
                 }
             )
-        _logger.info("Received %s attachments with parsed content", len(attachments))
+        _logger.info(
+            "Received %d of %d attachments with parsed content", len(attachments), len(files)
+        )
     else:
         try:
-            data = await req.json()
+            data = json_loads(await req.body())
         except Exception as exc:
             raise HTTPException(status_code=400, detail="Invalid JSON body") from exc
 
@@ -162,19 +307,16 @@ async def general_chat(
     if last_user is None:
         raise HTTPException(status_code=400, detail="at least one user message is required")
 
+    meaningful = _has_meaningful_token(last_user.content)
+    # Near-duplicate matching is only safe for single-turn questions without attachments;
+    # the same embedding then drives retrieval, so the query is embedded once.
+    query_vector = None
+    if meaningful and not attachments and len(request.messages) == 1 and not request.stream:
+        query_vector = await _embed_semantic_query(last_user.content)
+
     nodes: List = []
     system_messages: List[dict[str, str]] = []
 
-    meaningful_tokens = [
-        token
-        for token in re.findall(r"[a-zA-Z0-9]+", last_user.content.lower())
-        if len(token) >= 4 and token not in GENERIC_PROMPT_WORDS
-    ]
-
-    prompt_lower = last_user.content.lower()
-    wants_summary = bool(re.search(r"summari[sz]e|summary", prompt_lower))
-    refers_to_this = "this" in prompt_lower or "that" in prompt_lower
-
     if attachments:
         attachment_lines = []
         for attachment in attachments:
@@ -192,18 +334,19 @@ async def general_chat(
                 ),
             }
         )
-    elif meaningful_tokens:
+    elif meaningful:
         similarity_floor = 0.55
         try:
-            raw_nodes = rag_store.retrieve("general", last_user.content)
+            raw_nodes = await run_in_threadpool(
+                rag_store.retrieve, "general", last_user.content, query_vector
+            )
             nodes = [n for n in raw_nodes if getattr(n, "score", 0) >= similarity_floor]
             if not nodes and raw_nodes:
                 nodes = raw_nodes[:2]
             if nodes:
                 cite_block_lines = []
-                for idx, node in enumerate(nodes, start=1):
+                for idx, (node, content) in enumerate(iter_node_text(nodes), start=1):
                     source_name = node.node.metadata.get("source", "unknown")
-                    content = node.node.get_content().strip()
                     snippet = content if len(content) <= 1200 else content[:1200] + "…"
                     cite_block_lines.append(f"[{idx}] {source_name}: {snippet}")
                 cite_block = "\n".join(cite_block_lines)
@@ -224,6 +367,9 @@ async def general_chat(
         except CorpusNotReady:
             nodes = []
     else:
+        prompt_lower = last_user.content.lower()
+        wants_summary = bool(_SUMMARY_RE.search(prompt_lower))
+        refers_to_this = "this" in prompt_lower or "that" in prompt_lower
         if wants_summary and refers_to_this:
             return ChatResponse(
                 response=(
@@ -242,23 +388,26 @@ async def general_chat(
         )
 
     payload = system_messages + _prepare_payload(request.messages)
+    if request.stream:
+        return StreamingResponse(_stream_chat(payload, request.model), media_type="text/event-stream")
 
     try:
-        raw_response = provider.chat(payload, model=request.model)
+        raw_response = await _cached_chat(payload, request.model, "general", query_vector)
     except ModelProviderError as exc:
         raise HTTPException(status_code=502, detail=str(exc)) from exc
 
-    guarded = apply_guardrails(raw_response, provider, settings)
+    guarded, simplified = await apply_guardrails(raw_response, provider, settings, rewrite_cache)
 
     return ChatResponse(
         response=guarded,
         sources=[],
         mode="general",
+        simplified=simplified,
     )
 
 
 @app.post("/chat/benefits", response_model=ChatResponse)
-def benefits_chat(
+async def benefits_chat(
     request: ChatRequest,
 ):
 
@@ -269,18 +418,27 @@ def benefits_chat(
     if last_user is None:
         raise HTTPException(status_code=400, detail="at least one user message is required")
 
-    try:
-        nodes = rag_store.retrieve("benefits", last_user.content)
-    except CorpusNotReady:
-        nodes = []
-
-    context_block = "\n\n".join(
-        node.node.get_content().strip()
-        for node in nodes
-        if node.node and node.node.get_content()
-    )
-    if not context_block:
-        context_block = "[No relevant context retrieved]"
+    # One embedding serves both the semantic response cache and retrieval.
+    query_vector = None
+    if len(request.messages) == 1 and not request.stream:
+        query_vector = await _embed_semantic_query(last_user.content)
+
+    limit = settings.benefits_preload_max_chars
+    known, preloaded_context = rag_store.cached_preloaded_context("benefits", limit)
+    if not known:
+        preloaded_context = await run_in_threadpool(rag_store.preloaded_context, "benefits", limit)
+    context_block = ""
+    if preloaded_context is None:
+        try:
+            nodes = await run_in_threadpool(
+                rag_store.retrieve, "benefits", last_user.content, query_vector
+            )
+        except CorpusNotReady:
+            nodes = []
+
+        context_block = "\n\n".join(content for _, content in iter_node_text(nodes, collapse_whitespace=True))
+        if not context_block:
+            context_block = "[No relevant context retrieved]"
 
     history_lines = [
         f"{('User' if msg.role == 'user' else 'Assistant')}: {msg.content}"
@@ -289,34 +447,39 @@ def benefits_chat(
     ]
     history_excerpt = "\n".join(history_lines[-6:])
 
-    system_prompt = (
-        "You are the benefits assistant for The Center for Discovery. Answer confidently, "
-        "clearly, and concisely using only the provided context. If information is missing, "
-        "reply with: 'I couldn't find that in the documentation.'"
-        " When you reference an organisation or resource that has a public website, include the official URL using Markdown link format (e.g., [Autism Speaks](https://autismspeaks.org))."
-    )
-
-    user_payload = (
-        (f"Conversation so far:\n{history_excerpt}\n\n" if history_excerpt else "")
-        + f"Context:\n{context_block}\n\nMost recent question: {last_user.content}"
-    )
+    if preloaded_context is not None:
+        system_prompt = f"{BENEFITS_SYSTEM_PROMPT}\n\nContext:\n{preloaded_context}"
+        user_payload = (
+            (f"Conversation so far:\n{history_excerpt}\n\n" if history_excerpt else "")
+            + f"Most recent question: {last_user.content}"
+        )
+    else:
+        system_prompt = BENEFITS_SYSTEM_PROMPT
+        user_payload = (
+            (f"Conversation so far:\n{history_excerpt}\n\n" if history_excerpt else "")
+            + f"Context:\n{context_block}\n\nMost recent question: {last_user.content}"
+        )
 
     augmented = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_payload},
     ]
 
+    if request.stream:
+        return StreamingResponse(_stream_chat(augmented, request.model), media_type="text/event-stream")
+
     try:
-        raw_response = provider.chat(augmented, model=request.model)
+        raw_response = await _cached_chat(augmented, request.model, "benefits", query_vector)
     except ModelProviderError as exc:
         raise HTTPException(status_code=502, detail=str(exc)) from exc
 
-    guarded = apply_guardrails(raw_response, provider, settings)
+    guarded, simplified = await apply_guardrails(raw_response, provider, settings, rewrite_cache)
 
     return ChatResponse(
         response=guarded,
         sources=[],
         mode="benefits",
+        simplified=simplified,
     )
 
 
@@ -335,12 +498,15 @@ async def generate_bip(
     fba_text: str | None = None
     if fba_file is not None:
         contents = await fba_file.read()
-        extracted = bip_service.extract_text_from_upload(fba_file.filename, contents)
+        extracted = await run_in_threadpool(
+            bip_service.extract_text_from_upload, fba_file.filename, contents
+        )
         if extracted is None:
             raise HTTPException(status_code=400, detail="Unsupported file type. Use PDF, DOCX, or TXT.")
         fba_text = extracted
 
-    prompt = bip_service.build_prompt(
+    prompt = await run_in_threadpool(
+        bip_service.build_prompt,
         name=name,
         age=age,
         diagnosis=diagnosis,
@@ -352,8 +518,60 @@ async def generate_bip(
     )
 
     try:
-        bip_text = bip_service.generate(prompt, model_override=model)
+        bip_text = await bip_service.agenerate(prompt, model_override=model)
     except ModelProviderError as exc:
         raise HTTPException(status_code=502, detail=str(exc)) from exc
 
     return BIPResponse(bip=bip_text)
+
+
+@app.post("/bip/generate_batch")
+async def generate_bip_batch(
+    profiles_file: UploadFile = File(...),
+    model: str | None = Form(None),
+):
+    """Generate one BIP per JSONL profile line, streamed back as NDJSON."""
+    contents = await profiles_file.read()
+    profiles: List[BIPRequest] = []
+    for line_no, line in enumerate(contents.decode("utf-8", errors="ignore").splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            profiles.append(BIPRequest(**json_loads(line)))
+        except (json.JSONDecodeError, TypeError, ValidationError) as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid profile on line {line_no}: {exc}") from exc
+    if not profiles:
+        raise HTTPException(status_code=400, detail="profiles_file contains no profiles")
+
+    semaphore = asyncio.Semaphore(max(1, settings.bip_batch_concurrency))
+
+    async def run(index: int, profile: BIPRequest) -> BIPBatchResult:
+        async with semaphore:
+            prompt = await run_in_threadpool(
+                bip_service.build_prompt,
+                name=profile.name,
+                age=profile.age,
+                diagnosis=profile.diagnosis,
+                behavior=profile.behavior,
+                setting=profile.setting,
+                trigger=profile.trigger,
+                notes=profile.notes,
+                fba_text=None,
+            )
+            try:
+                bip_text = await bip_service.agenerate(prompt, model_override=model)
+            except ModelProviderError as exc:
+                return BIPBatchResult(index=index, name=profile.name, error=str(exc))
+            return BIPBatchResult(index=index, name=profile.name, bip=bip_text)
+
+    async def stream():
+        tasks = [asyncio.create_task(run(index, profile)) for index, profile in enumerate(profiles)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield result.model_dump_json() + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -2,11 +2,12 @@ from __future__ import annotations
 
 import json
 import logging
-from typing import Any, Dict, List, Optional
+from typing import AsyncIterator, Dict, Iterator, List, Optional
 
-import requests
-from requests import Response
+import anyio
+import httpx
 
+from .jsonutil import json_bytes, json_loads
 from .settings import Settings
 
 try:
@@ -14,8 +15,16 @@ try:
 except ImportError:  # pragma: no cover - optional dependency
     OpenAI = None  # type: ignore
 
+try:
+    import h2  # noqa: F401 - lets httpx negotiate HTTP/2
+    _HTTP2_AVAILABLE = True
+except ImportError:  # pragma: no cover - optional dependency
+    _HTTP2_AVAILABLE = False
+
 _logger = logging.getLogger(__name__)
 
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
 
 class ModelProviderError(RuntimeError):
     pass
@@ -27,6 +36,7 @@ class ModelProvider:
     def __init__(self, settings: Settings):
         self.settings = settings
         self._openai_client: Optional[OpenAI] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
 
         if settings.model_provider == "openai":
             if OpenAI is None:
@@ -40,19 +50,62 @@ class ModelProvider:
                 base_url=settings.openai_base_url or "https://api.openai.com/v1",
             )
 
-    def chat(self, messages: List[Dict[str, str]], model: Optional[str] = None) -> str:
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # Created on first use so it binds to the running event loop. With h2 installed,
+        # an HTTPS endpoint (e.g. Ollama behind a TLS proxy) multiplexes concurrent
+        # requests over one connection; plain http:// stays on HTTP/1.1 keep-alive.
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                timeout=self.settings.request_timeout,
+                # Limits belong on the transport: httpx ignores client limits when one is given.
+                transport=httpx.AsyncHTTPTransport(
+                    http2=_HTTP2_AVAILABLE,
+                    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                    retries=self.settings.max_retries,
+                ),
+            )
+        return self._async_client
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    async def achat(self, messages: List[Dict[str, str]], model: Optional[str] = None) -> str:
+        """Return the full reply without tying up a worker thread."""
         provider = self.settings.model_provider.lower()
         model_name = model or self.settings.default_model
 
         if provider == "ollama":
-            return self._chat_with_ollama(messages, model_name)
+            return await self._achat_with_ollama(messages, model_name)
         if provider == "openai":
-            return self._chat_with_openai(messages, model_name)
+            return await anyio.to_thread.run_sync(self._chat_with_openai, messages, model_name)
 
         raise ModelProviderError(f"Unsupported model provider: {provider}")
 
+    async def achat_stream(
+        self, messages: List[Dict[str, str]], model: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Yield response text fragments as the backend generates them."""
+        provider = self.settings.model_provider.lower()
+        model_name = model or self.settings.default_model
+
+        if provider == "ollama":
+            async for chunk in self._astream_with_ollama(messages, model_name):
+                yield chunk
+        elif provider == "openai":
+            # The OpenAI SDK stream is blocking; pull each event on a worker thread.
+            stream = self._stream_with_openai(messages, model_name)
+            while True:
+                chunk = await anyio.to_thread.run_sync(next, stream, None)
+                if chunk is None:
+                    break
+                yield chunk
+        else:
+            raise ModelProviderError(f"Unsupported model provider: {provider}")
+
     # ---- Ollama ----
-    def _chat_with_ollama(self, messages: List[Dict[str, str]], model: str) -> str:
+    async def _achat_with_ollama(self, messages: List[Dict[str, str]], model: str) -> str:
         payload = {
             "model": model,
             "messages": messages,
@@ -60,8 +113,10 @@ class ModelProvider:
         }
         url = f"{self.settings.ollama_base_url.rstrip('/')}/api/chat"
         try:
-            response = requests.post(url, json=payload, timeout=self.settings.request_timeout)
-        except requests.RequestException as exc:
+            response = await self._get_async_client().post(
+                url, content=json_bytes(payload), headers=_JSON_HEADERS
+            )
+        except httpx.HTTPError as exc:
             raise ModelProviderError(f"Ollama request failed: {exc}") from exc
 
         content = self._extract_ollama_content(response)
@@ -71,13 +126,50 @@ class ModelProvider:
             )
         return content
 
+    async def _astream_with_ollama(
+        self, messages: List[Dict[str, str]], model: str
+    ) -> AsyncIterator[str]:
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True,
+        }
+        url = f"{self.settings.ollama_base_url.rstrip('/')}/api/chat"
+        try:
+            async with self._get_async_client().stream(
+                "POST", url, content=json_bytes(payload), headers=_JSON_HEADERS
+            ) as response:
+                if not response.is_success:
+                    body = (await response.aread()).decode("utf-8", "replace")
+                    _logger.error("Ollama error %s: %s", response.status_code, body[:200])
+                    raise ModelProviderError(
+                        f"Unexpected Ollama response: {response.status_code} {body[:200]}"
+                    )
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        data = json_loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if data.get("error"):
+                        raise ModelProviderError(f"Ollama stream error: {data['error']}")
+                    content = (data.get("message") or {}).get("content")
+                    if content:
+                        yield content
+                    if data.get("done"):
+                        return
+        except httpx.HTTPError as exc:
+            raise ModelProviderError(f"Ollama stream interrupted: {exc}") from exc
+        raise ModelProviderError("Ollama stream ended before the reply was done")
+
     @staticmethod
-    def _extract_ollama_content(response: Response) -> Optional[str]:
-        if not response.ok:
+    def _extract_ollama_content(response: httpx.Response) -> Optional[str]:
+        if not response.is_success:
             _logger.error("Ollama error %s: %s", response.status_code, response.text[:200])
             return None
         try:
-            data = response.json()
+            data = json_loads(response.content)
         except json.JSONDecodeError:
             return None
 
@@ -86,11 +178,11 @@ class ModelProvider:
         return content
 
     # ---- OpenAI ----
-    def _chat_with_openai(self, messages: List[Dict[str, str]], model: str) -> str:
+    def _openai_input(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
         if self._openai_client is None:  # pragma: no cover - guarded above
             raise ModelProviderError("OpenAI client not initialised")
 
-        formatted = [
+        return [
             {
                 "role": msg["role"],
                 "content": msg["content"],
@@ -98,6 +190,23 @@ class ModelProvider:
             for msg in messages
         ]
 
+    def _stream_with_openai(self, messages: List[Dict[str, str]], model: str) -> Iterator[str]:
+        formatted = self._openai_input(messages)
+        try:
+            stream = self._openai_client.responses.create(
+                model=model,
+                input=formatted,
+                stream=True,
+            )
+            for event in stream:
+                if getattr(event, "type", None) == "response.output_text.delta":
+                    yield event.delta
+        except Exception as exc:  # broad catch to surface provider errors cleanly
+            raise ModelProviderError(f"OpenAI request failed: {exc}") from exc
+
+    def _chat_with_openai(self, messages: List[Dict[str, str]], model: str) -> str:
+        formatted = self._openai_input(messages)
+
         try:
             response = self._openai_client.responses.create(
                 model=model,
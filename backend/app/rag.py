@@ -1,41 +1,124 @@
 from __future__ import annotations
 
+import hashlib
 import logging
+import os
+import pickle
 import shutil
+import threading
+from collections import OrderedDict
+from functools import cached_property, lru_cache
 from pathlib import Path
-from typing import Any, Dict, List
-
-from llama_index.core import (
-    SimpleDirectoryReader,
-    StorageContext,
-    VectorStoreIndex,
-    load_index_from_storage,
-)
-from llama_index.core.schema import NodeWithScore
-from llama_index.embeddings.ollama import OllamaEmbedding
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
+from .cache import SemanticCache, TTLCache
+from .embeddings import get_embed_model
 from .settings import Settings
 
+if TYPE_CHECKING:
+    from llama_index.core import VectorStoreIndex
+    from llama_index.core.schema import NodeWithScore
+    from llama_index.embeddings.ollama import OllamaEmbedding
+
 _logger = logging.getLogger(__name__)
 
+FAISS_INDEX_FILE = "vector_store.faiss"
+STORAGE_SNAPSHOT_FILE = "storage_context.pkl"
+CORPORA = ("general", "benefits", "bip_policies")
+
 
 class CorpusNotReady(RuntimeError):
     pass
 
 
+# llama-index and faiss take over a second to import, so they are loaded on first
+# retrieval or rebuild rather than at worker startup.
+@lru_cache(maxsize=1)
+def _faiss():
+    try:
+        import faiss
+        from llama_index.vector_stores.faiss import FaissVectorStore
+    except ImportError:  # pragma: no cover - optional dependency
+        return None, None
+    return faiss, FaissVectorStore
+
+
+def iter_node_text(
+    nodes: Iterable[NodeWithScore], collapse_whitespace: bool = False
+) -> Iterator[Tuple[NodeWithScore, str]]:
+    """Yield retrieved nodes with their stripped content, reading each node once.
+
+    With ``collapse_whitespace`` every whitespace run becomes a single space in the
+    same pass, which keeps prompt context compact.
+    """
+    for node in nodes:
+        if not node.node:
+            continue
+        content = node.node.get_content()
+        if not content:
+            continue
+        content = " ".join(content.split()) if collapse_whitespace else content.strip()
+        if content:
+            yield node, content
+
+
+def _dedupe_nodes(nodes: List[Any], threshold: float) -> List[Any]:
+    """Drop chunks that repeat an earlier one, before they are embedded.
+
+    Exact repeats (ignoring case and spacing) are always dropped. With datasketch
+    installed, chunks whose word 5-gram MinHash Jaccard estimate with a kept chunk
+    reaches ``threshold`` are dropped too.
+    """
+    try:
+        from datasketch import MinHash, MinHashLSH
+    except ImportError:  # pragma: no cover - optional dependency
+        MinHash = MinHashLSH = None  # type: ignore
+
+    lsh = MinHashLSH(threshold=threshold, num_perm=128) if MinHashLSH and threshold < 1 else None
+    seen = set()
+    kept = []
+    for position, node in enumerate(nodes):
+        words = node.get_content().lower().split()
+        digest = hashlib.sha1(" ".join(words).encode("utf-8")).digest()
+        if words and digest in seen:
+            continue
+        seen.add(digest)
+        if lsh is not None and len(words) >= 5:
+            minhash = MinHash(num_perm=128)
+            minhash.update_batch(
+                [" ".join(words[i : i + 5]).encode("utf-8") for i in range(len(words) - 4)]
+            )
+            if lsh.query(minhash):
+                continue
+            lsh.insert(str(position), minhash)
+        kept.append(node)
+    return kept
+
+
 class RAGStore:
     """Lazy loader for vector stores backed by llama-index."""
 
     def __init__(self, settings: Settings):
         self.settings = settings
         self._retrievers: Dict[str, Any] = {}
+        self._indexes: Dict[str, VectorStoreIndex] = {}
         self._index_meta: Dict[str, Dict[str, Path]] = {}
+        self._load_locks = {corpus: threading.Lock() for corpus in CORPORA}
+        self.version = 0
+        self._preloaded: Dict[str, Tuple[int, int, Optional[str]]] = {}
+        self._query_embeddings: OrderedDict[str, List[float]] = OrderedDict()
+        self._query_embeddings_lock = threading.Lock()
+        self._retrieval_cache = TTLCache(settings.retrieval_cache_size, settings.retrieval_cache_ttl)
+        self._semantic_retrievals = SemanticCache(
+            settings.retrieval_cache_size, settings.semantic_cache_threshold
+        )
 
+    @cached_property
     def _embed_model(self) -> OllamaEmbedding:
-        base_url = self.settings.ollama_base_url.rstrip("/")
-        return OllamaEmbedding(
-            model_name=self.settings.embed_model,
-            base_url=base_url,
+        return get_embed_model(
+            self.settings.embed_model,
+            self.settings.ollama_base_url,
+            self.settings.embed_batch_size,
         )
 
     def _store_dir(self, corpus: str) -> Path:
@@ -59,13 +142,44 @@ class RAGStore:
         return 3
 
     def _load_index(self, corpus: str) -> VectorStoreIndex:
+        from llama_index.core import Settings as LlamaSettings
+        from llama_index.core import (
+            SimpleDirectoryReader,
+            StorageContext,
+            VectorStoreIndex,
+            load_index_from_storage,
+        )
+
         store_dir = self._store_dir(corpus)
         store_dir.mkdir(parents=True, exist_ok=True)
 
-        embed_model = self._embed_model()
+        faiss, FaissVectorStore = _faiss()
+        embed_model = self._embed_model
 
         if (store_dir / "docstore.json").exists():
-            storage_context = StorageContext.from_defaults(persist_dir=str(store_dir))
+            faiss_path = store_dir / FAISS_INDEX_FILE
+            vector_store = None
+            if faiss_path.exists():
+                if faiss is None:
+                    raise CorpusNotReady(
+                        f"Corpus '{corpus}' was built with FAISS; install faiss-cpu and "
+                        "llama-index-vector-stores-faiss or rebuild it."
+                    )
+                # IO_FLAG_MMAP_IFC (faiss >= 1.11) serves the HNSW graph and codes from the file
+                # mapping, so workers share the page cache; plain IO_FLAG_MMAP still copies them.
+                mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+                faiss_index = faiss.read_index(str(faiss_path), mmap_flag)
+                faiss_index.hnsw.efSearch = self.settings.faiss_ef_search
+                vector_store = FaissVectorStore(faiss_index=faiss_index)
+            signature = self._docstore_signature(store_dir)
+            storage_context = self._read_snapshot(store_dir, signature, vector_store)
+            if storage_context is None:
+                storage_context = StorageContext.from_defaults(
+                    vector_store=vector_store, persist_dir=str(store_dir)
+                )
+                self._write_snapshot(
+                    store_dir, signature, storage_context, faiss_backed=vector_store is not None
+                )
             return load_index_from_storage(storage_context, embed_model=embed_model)
 
         data_dir = self._data_dir(corpus)
@@ -75,23 +189,247 @@ class RAGStore:
             )
 
         docs = SimpleDirectoryReader(str(data_dir)).load_data()
-        index = VectorStoreIndex.from_documents(docs, embed_model=embed_model)
+        nodes = LlamaSettings.node_parser.get_nodes_from_documents(docs)
+        deduped = _dedupe_nodes(nodes, self.settings.ingest_dedupe_threshold)
+        if len(deduped) < len(nodes):
+            _logger.info(
+                "Dropped %d near-duplicate chunks from %s", len(nodes) - len(deduped), corpus
+            )
+        nodes = deduped
+
+        faiss_index = self._new_faiss_index(len(nodes), embed_model)
+        if faiss_index is None:
+            index = VectorStoreIndex(nodes, embed_model=embed_model)
+        else:
+            storage_context = StorageContext.from_defaults(
+                vector_store=FaissVectorStore(faiss_index=faiss_index)
+            )
+            index = VectorStoreIndex(nodes, storage_context=storage_context, embed_model=embed_model)
         index.storage_context.persist(persist_dir=str(store_dir))
+        if faiss_index is not None:
+            # persist() already wrote the FAISS binary under the default vector store's
+            # JSON name; rename it rather than writing the index a second time.
+            from llama_index.core.storage.storage_context import (
+                DEFAULT_VECTOR_STORE,
+                NAMESPACE_SEP,
+                VECTOR_STORE_FNAME,
+            )
+
+            persisted = store_dir / f"{DEFAULT_VECTOR_STORE}{NAMESPACE_SEP}{VECTOR_STORE_FNAME}"
+            persisted.replace(store_dir / FAISS_INDEX_FILE)
+        self._write_snapshot(
+            store_dir,
+            self._docstore_signature(store_dir),
+            index.storage_context,
+            faiss_backed=faiss_index is not None,
+        )
+        return index
+
+    @staticmethod
+    def _docstore_signature(store_dir: Path) -> Tuple[int, int]:
+        stat = (store_dir / "docstore.json").stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _read_snapshot(store_dir: Path, signature: Tuple[int, int], vector_store: Any = None):
+        # The JSON stores take seconds to parse for a large corpus; a pickle of the
+        # same objects loads in a fraction of that. The snapshot leads with the
+        # docstore.json mtime and size it was taken from and is used only on an exact
+        # match, so copied-in stores or pickles from another llama-index version are ignored.
+        from llama_index.core import StorageContext
+
+        path = store_dir / STORAGE_SNAPSHOT_FILE
+        try:
+            with path.open("rb") as handle:
+                if pickle.load(handle) != signature:
+                    return None
+                snapshot = pickle.load(handle)
+            return StorageContext.from_defaults(
+                docstore=snapshot["docstore"],
+                index_store=snapshot["index_store"],
+                vector_store=vector_store if vector_store is not None else snapshot["vector_store"],
+            )
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            _logger.warning("Ignoring storage snapshot %s: %s", path, exc)
+            return None
+
+    @staticmethod
+    def _write_snapshot(
+        store_dir: Path, signature: Tuple[int, int], storage_context: Any, faiss_backed: bool
+    ) -> None:
+        # FAISS indexes cannot be pickled and already load from their own binary file.
+        snapshot = {
+            "docstore": storage_context.docstore,
+            "index_store": storage_context.index_store,
+            "vector_store": None if faiss_backed else storage_context.vector_store,
+        }
+        path = store_dir / STORAGE_SNAPSHOT_FILE
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with tmp_path.open("wb") as handle:
+                pickle.dump(signature, handle, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(snapshot, handle, pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(path)
+        except OSError as exc:
+            _logger.warning("Could not write storage snapshot %s: %s", path, exc)
+
+    def _new_faiss_index(self, node_count: int, embed_model: OllamaEmbedding):
+        # Flat search is already fast for small corpora; HNSW pays off as they grow.
+        faiss, _ = _faiss()
+        if faiss is None or node_count < self.settings.faiss_min_vectors:
+            return None
+        dimension = len(embed_model.get_text_embedding("dimension probe"))
+        # Ollama returns unit-length embeddings, so inner product equals cosine
+        # similarity and scores stay comparable with the flat store's.
+        if self.settings.faiss_fp16:
+            # Half-precision storage halves the bytes each graph hop reads; the
+            # similarity error is far below the gap between relevant chunks.
+            faiss_index = faiss.IndexHNSWSQ(
+                dimension,
+                faiss.ScalarQuantizer.QT_fp16,
+                self.settings.faiss_hnsw_m,
+                faiss.METRIC_INNER_PRODUCT,
+            )
+        else:
+            faiss_index = faiss.IndexHNSWFlat(
+                dimension, self.settings.faiss_hnsw_m, faiss.METRIC_INNER_PRODUCT
+            )
+        faiss_index.hnsw.efSearch = self.settings.faiss_ef_search
+        return faiss_index
+
+    def _activate(self, corpus: str, index: VectorStoreIndex) -> VectorStoreIndex:
+        # The retriever is built alongside the index, so queries never construct one.
+        self._retrievers[corpus] = index.as_retriever(similarity_top_k=self._top_k(corpus))
+        self._indexes[corpus] = index
+        return index
+
+    def index(self, corpus: str) -> VectorStoreIndex:
+        index = self._indexes.get(corpus)
+        if index is None:
+            # Startup warm-up and the first request may ask for the same corpus at once.
+            with self._load_locks[corpus]:
+                index = self._indexes.get(corpus)
+                if index is None:
+                    index = self._activate(corpus, self._load_index(corpus))
         return index
 
     def retriever(self, corpus: str):  # type: ignore[override]
-        if corpus not in self._retrievers:
-            index = self._load_index(corpus)
-            self._retrievers[corpus] = index.as_retriever(similarity_top_k=self._top_k(corpus))
-        return self._retrievers[corpus]
+        retriever = self._retrievers.get(corpus)
+        if retriever is None:
+            self.index(corpus)
+            retriever = self._retrievers[corpus]
+        return retriever
+
+    def warm_up(self, corpora: Iterable[str] = CORPORA) -> None:
+        """Load persisted indexes and retrievers ahead of the first query.
+
+        Corpora without a persisted store are skipped; building them is left to ingest
+        or the first request rather than every worker embedding the corpus at startup.
+        """
+        for corpus in corpora:
+            if not (self._store_dir(corpus) / "docstore.json").exists():
+                _logger.info("Skipping warm-up for %s: no persisted index", corpus)
+                continue
+            try:
+                self.index(corpus)
+            except CorpusNotReady as exc:
+                _logger.info("Skipping warm-up for %s: %s", corpus, exc)
+            except Exception as exc:
+                _logger.warning("Warm-up failed for %s: %s", corpus, exc)
+
+    def corpus_texts(self, corpus: str) -> List[str]:
+        """Every stored chunk of a corpus, whitespace-collapsed, in docstore order."""
+        texts = []
+        for node in self.index(corpus).docstore.docs.values():
+            content = " ".join(node.get_content().split())
+            if content:
+                texts.append(content)
+        return texts
+
+    def cached_preloaded_context(self, corpus: str, max_chars: int) -> Tuple[bool, Optional[str]]:
+        """``(True, context)`` when :meth:`preloaded_context` is already known for this version."""
+        entry = self._preloaded.get(corpus)
+        if entry is not None and entry[:2] == (self.version, max_chars):
+            return True, entry[2]
+        return False, None
+
+    def preloaded_context(self, corpus: str, max_chars: int) -> Optional[str]:
+        """The whole corpus as one prompt block, or ``None`` if it exceeds ``max_chars``."""
+        # A corpus small enough to send verbatim gives a byte-identical prompt prefix, so
+        # the model server's prompt cache (Ollama's KV reuse, OpenAI's prefix caching) only
+        # has to process the question, and no per-query retrieval is needed. Ollama silently
+        # truncates prompts longer than num_ctx (2048 tokens by default), so the limit
+        # must leave room for the instructions, history and answer.
+        known, context = self.cached_preloaded_context(corpus, max_chars)
+        if known:
+            return context
+        version = self.version
+        context = None
+        if max_chars > 0:
+            try:
+                block = "\n\n".join(self.corpus_texts(corpus))
+            except CorpusNotReady:
+                block = ""
+            if block and len(block) <= max_chars:
+                context = block
+        self._preloaded[corpus] = (version, max_chars, context)
+        return context
+
+    def retrieve(
+        self,
+        corpus: str,
+        query: str,
+        embedding: Optional[List[float]] = None,
+    ) -> List[NodeWithScore]:
+        # Case and spacing differences ("Dental plan?" vs "dental  plan?") share an entry.
+        normalised = " ".join(query.lower().split())
+        key = (corpus, hashlib.sha1(normalised.encode("utf-8")).hexdigest())
+        cached = self._retrieval_cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+        from llama_index.core.schema import QueryBundle
 
-    def retrieve(self, corpus: str, query: str) -> List[NodeWithScore]:
         retriever = self.retriever(corpus)
         try:
-            return retriever.retrieve(query)
+            if embedding is None:
+                embedding = self.embed_query(query)
+            nodes = self._semantic_retrievals.get(corpus, embedding)
+            if nodes is None:
+                nodes = retriever.retrieve(QueryBundle(query_str=query, embedding=embedding))
+                self._semantic_retrievals.put(corpus, embedding, nodes)
         except Exception as exc:
             _logger.error("RAG retrieval failed for %s: %s", corpus, exc)
             raise
+        self._retrieval_cache.put(key, nodes)
+        return list(nodes)
+
+    def embed_query(self, query: str) -> List[float]:
+        key = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        with self._query_embeddings_lock:
+            cached = self._query_embeddings.get(key)
+            if cached is not None:
+                self._query_embeddings.move_to_end(key)
+                return cached
+
+        embedding = self._embed_model.get_query_embedding(query)
+
+        with self._query_embeddings_lock:
+            self._query_embeddings[key] = embedding
+            while len(self._query_embeddings) > self.settings.query_embedding_cache_size:
+                self._query_embeddings.popitem(last=False)
+        return embedding
+
+    def cache_stats(self) -> Dict[str, Any]:
+        with self._query_embeddings_lock:
+            embeddings = len(self._query_embeddings)
+        return {
+            "retrieval": self._retrieval_cache.stats(),
+            "semantic_retrieval": self._semantic_retrievals.stats(),
+            "query_embeddings": {"size": embeddings},
+        }
 
     def rebuild(self, corpus: str) -> None:
         store_dir = self._store_dir(corpus)
@@ -101,6 +439,9 @@ class RAGStore:
                     shutil.rmtree(item)
                 else:
                     item.unlink()
-        if corpus in self._retrievers:
-            del self._retrievers[corpus]
-        self._load_index(corpus)
+        self._retrievers.pop(corpus, None)
+        self._indexes.pop(corpus, None)
+        self.version += 1
+        self._retrieval_cache.clear()
+        self._semantic_retrievals.clear()
+        self._activate(corpus, self._load_index(corpus))
@@ -14,6 +14,7 @@ class ChatRequest(BaseModel):
     model: Optional[str] = None
     messages: List[ChatMessage]
     allow_generalization: bool = False
+    stream: bool = False
 
 
 class SourceDocument(BaseModel):
@@ -25,9 +26,10 @@ class ChatResponse(BaseModel):
     response: str
     sources: List[SourceDocument] = []
     mode: str
+    simplified: bool = False
 
 
-class BIPRequest(BaseModel):  # Used for OpenAPI schema; actual endpoint uses multipart form
+class BIPRequest(BaseModel):  # OpenAPI schema and batch JSONL lines; /bip/generate uses multipart form
     name: str
     age: int
     diagnosis: str
@@ -39,3 +41,10 @@ class BIPRequest(BaseModel):  # Used for OpenAPI schema; actual endpoint uses mu
 
 class BIPResponse(BaseModel):
     bip: str
+
+
+class BIPBatchResult(BaseModel):
+    index: int
+    name: str
+    bip: Optional[str] = None
+    error: Optional[str] = None
@@ -22,6 +22,7 @@ class Settings(BaseSettings):
     default_model: str = Field("llama3.1", validation_alias="DEFAULT_CHAT_MODEL")
     rewrite_model: str = Field("llama3.1", validation_alias="REWRITE_MODEL")
     embed_model: str = Field("nomic-embed-text", validation_alias="EMBED_MODEL")
+    embed_batch_size: int = Field(64, validation_alias="EMBED_BATCH_SIZE")
 
     ollama_base_url: str = Field(
         "http://localhost:11434",
@@ -59,9 +60,28 @@ class Settings(BaseSettings):
     general_top_k: int = Field(3, validation_alias="GENERAL_TOP_K")
     benefits_top_k: int = Field(3, validation_alias="BENEFITS_TOP_K")
     bip_top_k: int = Field(4, validation_alias="BIP_TOP_K")
+    rag_warmup: bool = Field(True, validation_alias="RAG_WARMUP")
+    ingest_dedupe_threshold: float = Field(0.9, validation_alias="INGEST_DEDUPE_THRESHOLD")
+    faiss_min_vectors: int = Field(1000, validation_alias="FAISS_MIN_VECTORS")
+    faiss_hnsw_m: int = Field(32, validation_alias="FAISS_HNSW_M")
+    faiss_ef_search: int = Field(64, validation_alias="FAISS_EF_SEARCH")
+    faiss_fp16: bool = Field(True, validation_alias="FAISS_FP16")
+    benefits_preload_max_chars: int = Field(4000, validation_alias="BENEFITS_PRELOAD_MAX_CHARS")
+    bip_batch_concurrency: int = Field(4, validation_alias="BIP_BATCH_CONCURRENCY")
 
     request_timeout: int = Field(120, validation_alias="MODEL_REQUEST_TIMEOUT")
     max_retries: int = Field(2, validation_alias="MODEL_MAX_RETRIES")
+    rewrite_timeout: float = Field(5.0, validation_alias="REWRITE_TIMEOUT")
+    rewrite_max_in_flight: int = Field(8, validation_alias="REWRITE_MAX_IN_FLIGHT")
+
+    response_cache_size: int = Field(256, validation_alias="RESPONSE_CACHE_SIZE")
+    response_cache_ttl: int = Field(3600, validation_alias="RESPONSE_CACHE_TTL")
+    semantic_cache_threshold: float = Field(0.95, validation_alias="SEMANTIC_CACHE_THRESHOLD")
+    query_embedding_cache_size: int = Field(1024, validation_alias="QUERY_EMBEDDING_CACHE_SIZE")
+    retrieval_cache_size: int = Field(256, validation_alias="RETRIEVAL_CACHE_SIZE")
+    retrieval_cache_ttl: int = Field(900, validation_alias="RETRIEVAL_CACHE_TTL")
+    rewrite_cache_size: int = Field(512, validation_alias="REWRITE_CACHE_SIZE")
+    rewrite_cache_ttl: int = Field(24 * 3600, validation_alias="REWRITE_CACHE_TTL")
 
     cors_allow_origins: str = Field(
         "http://localhost:5173,http://127.0.0.1:5173,http://0.0.0.0:5173",
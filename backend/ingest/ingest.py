@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 from app.rag import CorpusNotReady, RAGStore
 from app.settings import Settings, get_settings
@@ -33,8 +34,10 @@ def main() -> None:
         else ["general", "benefits", "bip_policies"]
     )
 
-    for corpus in targets:
-        rebuild_corpus(rag_store, corpus)
+    # Rebuilds spend their time waiting on the embedding server, so run them side by side.
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        for future in [pool.submit(rebuild_corpus, rag_store, corpus) for corpus in targets]:
+            future.result()
 
 
 if __name__ == "__main__":